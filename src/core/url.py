@@ -3,47 +3,101 @@ from __future__ import annotations
 import socket
 import ssl
 import os
+import sys
 import base64
-import gzip
 import time
 import re
-from datetime import datetime, timedelta
+import threading
+import heapq
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from enum import Enum
+from html import unescape
 
-SCHEMES = (
-    "http", "https", "file", "data", "view-source", "about"
-)
+try:
+    # python-isal is a drop-in for zlib backed by ISA-L's SIMD deflate
+    from isal import isal_zlib as zlib
+except ImportError:
+    import zlib
 
 
 class CacheEntry:
+    __slots__ = ("response", "expiry")
+    
     def __init__(self, response, expiry):
         self.response = response
         self.expiry = expiry
         
 
 class Cache:
-    def __init__(self):
-        self.cache = {}
+    def __init__(self, max_entries=512, max_bytes=64 << 20):
+        self.cache = OrderedDict()
+        self.expiries = []
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.lock = threading.Lock()
         
     def get(self, url):
-        entry = self.cache.get(url)
-        if entry is None:
-            return None
-        if entry.expiry < datetime.now():
-            del self.cache[url]
-            return None
-        return entry.response
+        with self.lock:
+            self.purge(time.monotonic())
+            entry = self.cache.get(url)
+            if entry is None:
+                return None
+            self.cache.move_to_end(url)
+            return entry.response
     
     def set(self, url, response, max_age):
-        expiry = datetime.now() + timedelta(seconds=max_age)
-        self.cache[url] = CacheEntry(response, expiry)
+        now = time.monotonic()
+        expiry = now + max_age
+        with self.lock:
+            self.purge(now)
+            self.discard(url)
+            if len(response) > self.max_bytes:
+                return
+            self.cache[url] = CacheEntry(response, expiry)
+            self.size += len(response)
+            heapq.heappush(self.expiries, (expiry, url))
+            # Evict least recently used entries until both limits hold again
+            while self.cache and (len(self.cache) > self.max_entries or self.size > self.max_bytes):
+                _, evicted = self.cache.popitem(last=False)
+                self.size -= len(evicted.response)
+            # Overwritten and evicted URLs leave stale heap items behind
+            if len(self.expiries) > 2 * len(self.cache) + 64:
+                self.expiries = [(entry.expiry, key) for key, entry in self.cache.items()]
+                heapq.heapify(self.expiries)
+    
+    def purge(self, now):
+        expiries = self.expiries
+        while expiries and expiries[0][0] <= now:
+            _, url = heapq.heappop(expiries)
+            entry = self.cache.get(url)
+            if entry is not None and entry.expiry <= now:
+                self.discard(url)
+    
+    def discard(self, url):
+        entry = self.cache.pop(url, None)
+        if entry is not None:
+            self.size -= len(entry.response)
 
 
+READ_BUFFER_SIZE = 128 * 1024
+SOCKET_BUFFER_SIZE = 4 << 20
+DNS_TTL = 300
+
 cache = Cache()
+_conn_pool = {}
+_conn_pool_lock = threading.Lock()
+_dns_cache = {}
+_tls_sessions = {}
 
-URL_REGEX = re.compile(r'^(?P<scheme>[a-zA-Z][a-zA-Z0-9+.-]*):/{0,3}(?P<url>.*)$')
+TAG_REGEX = re.compile(r'<[^>]*>')
+BYTES_TAG_REGEX = re.compile(rb'<[^>]*>')
 
 class URL:
+    __slots__ = ("scheme", "url", "socket")
+    
     def __init__(self, scheme: str, url: str) -> None:
         self.scheme = scheme
         self.url = url
@@ -54,95 +108,272 @@ class URL:
     
 
 class HTTPURL(URL):
+    __slots__ = ("host", "port", "path", "origin", "cache_key", "request_bytes")
+    
     def __init__(self, scheme: str, url: str) -> None:
         super().__init__(scheme, url)
-        if "/" not in self.url:
-            self.url = self.url + "/"
-        self.host, self.url = self.url.split("/", 1)
-        self.path = "/" + self.url
-        self.port = 80 if self.scheme == "http" else 443
-        if ":" in self.host:
-            self.host, port = self.host.split(":", 1)
-            self.port = int(port)
+        default_port = 80 if self.scheme == "http" else 443
+        host, self.port, self.path = _parse_authority(url, default_port)
+        # Many URLs share a host; interning keeps one copy and makes pool/cache key compares cheap
+        self.host = sys.intern(host)
+        self.origin = f"{self.scheme}://{self.host}:{self.port}"
+        self.cache_key = self.origin + self.path
+        
+        # The request never changes for a given URL, so it is encoded once up front
+        # See https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers to find more examples
+        headers = {
+            "Host": self.host,
+            "User-Agent": "pybrow/1.0",
+            "Accept-Encoding": "gzip",
+            "Connection": "keep-alive",
+        }
+        lines = ["GET {} HTTP/1.1".format(self.path)]
+        lines.extend("{}: {}".format(k, v) for k, v in headers.items())
+        lines.append("\r\n")
+        self.request_bytes = "\r\n".join(lines).encode("utf8")
     
     def handle_redirect(self, response_headers: dict, max_redirects: int):
         assert max_redirects != 0, "Too many redirects"
         location = response_headers.get("location")
         assert location, "Redirect status without location"
         if location.startswith("/"):
-            location = f"{self.scheme}://{self.host}{location}"
+            location = self.origin + location
         elif not location.startswith("http"):
             location = f"{self.scheme}://{location}"
         return URLFactory.create(location).request(max_redirects - 1)
     
+    def connect(self):
+        sock = socket.socket(
+            family=socket.AF_INET,
+            type=socket.SOCK_STREAM,
+            # proto=socket.IPPROTO_TCP
+        )
+        # Send the request as soon as it is written instead of waiting on Nagle
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        try:
+            sock.connect(_resolve(self.host, self.port))
+        except OSError:
+            # The cached address may be what went stale
+            _dns_cache.pop((self.host, self.port), None)
+            sock.close()
+            raise
+        if self.scheme == "https":
+            sock = _ssl_context().wrap_socket(
+                sock,
+                server_hostname=self.host,
+                session=_tls_sessions.get((self.host, self.port)),
+            )
+        return sock
+    
+    def send_request(self):
+        self.socket.sendall(self.request_bytes)
+        response = SocketReader(self.socket)
+        head = response.read_until(b"\r\n\r\n")
+        return response, head
+    
     def request(self, max_redirects=5):
-        url = f"{self.scheme}://{self.host}{self.path}"
-        cached_response = cache.get(url)
+        cached_response = cache.get(self.cache_key)
         if cached_response:
             print("Using cached response")
             return cached_response
         
-        if self.socket is None:
-            self.socket = socket.socket(
-                family=socket.AF_INET,
-                type=socket.SOCK_STREAM,
-                # proto=socket.IPPROTO_TCP
-            )
-            self.socket.connect((self.host, self.port))
-            if self.scheme == "https":
-                ctx = ssl.create_default_context()
-                self.socket = ctx.wrap_socket(self.socket, server_hostname=self.host)
-        
-        # See https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers to find more examples
-        headers = {
-            "Host": self.host,
-            "User-Agent": "pybrow/1.0",
-            "Accept-Encoding": "gzip",
-        }
+        pool_key = (self.scheme, self.host, self.port)
+        self.socket = _conn_pool.pop(pool_key, None)
+        try:
+            head = b""
+            if self.socket is not None:
+                try:
+                    response, head = self.send_request()
+                except OSError:
+                    self.socket.close()
+                # An empty response means the server dropped the idle connection
+                if not head:
+                    self.socket.close()
+                    self.socket = None
+            if self.socket is None:
+                self.socket = self.connect()
+                response, head = self.send_request()
+            
+            while True:
+                statusline, *lines = head.decode("utf8").split("\r\n")
+                version, status, explanation = statusline.split(" ", 2)
+                # Interim replies such as 103 Early Hints precede the real one on the same connection
+                if not 100 <= int(status) < 200 or int(status) == 101:
+                    break
+                head = response.read_until(b"\r\n\r\n")
+            response_headers = {}
+            for line in lines:
+                if not line: continue
+                header, value = line.split(":", 1)
+                response_headers[header.casefold()] = value.strip()
+            
+            assert "content-enconding" not in response_headers, "Content encoding not supported"
+            
+            keep_alive = version != "HTTP/1.0" and response_headers.get("connection", "").casefold() != "close"
+            if int(status) == 101:
+                # Whatever follows is no longer HTTP, so the connection cannot be pooled
+                chunks = ()
+                keep_alive = False
+            elif int(status) in (204, 304):
+                # These never carry a body, whatever the headers say
+                chunks = ()
+            elif response_headers.get("transfer-encoding", "").casefold() == "chunked":
+                chunks = _iter_chunked(response)
+            elif "content-length" in response_headers:
+                chunks = response.iter_read(int(response_headers["content-length"]))
+            else:
+                chunks = response.iter_read()
+                keep_alive = False
+            
+            # Redirect bodies are drained so the connection can be reused, but never decoded
+            gzipped = response_headers.get("content-encoding") == "gzip" and not 300 <= int(status) < 400
+            content = _read_body(chunks, gzipped)
+        except Exception:
+            if self.socket is not None:
+                self.socket.close()
+                self.socket = None
+            raise
         
-        request = "GET {} HTTP/1.0\r\n".format(self.path)
-        for k, v in headers.items():
-            request += "{}: {}\r\n".format(k, v)
-        request += "\r\n"
-        self.socket.send(request.encode("utf8"))
+        if self.scheme == "https":
+            # TLS 1.3 tickets arrive after the handshake, so save the session once the response is in
+            _tls_sessions[(self.host, self.port)] = self.socket.session
+        if keep_alive:
+            _release_connection(pool_key, self.socket)
+        else:
+            self.socket.close()
+        self.socket = None
         
-        response = self.socket.makefile("rb", newline="\r\n")
-        statusline = response.readline().decode("utf8")
-        version, status, explanation = statusline.split(" ", 2)
-        response_headers = {}
-        while True:
-            line = response.readline().decode("utf8")
-            if line == "\r\n": break
-            header, value = line.split(":", 1)
-            response_headers[header.casefold()] = value.strip()
-            
         if 300 <= int(status) < 400:
             return self.handle_redirect(response_headers, max_redirects)
         
-        assert "transfer-encoding" not in response_headers, "Transfer encoding not supported"
-        assert "content-enconding" not in response_headers, "Content encoding not supported"
-        
-        content_length = int(response_headers.get("content-length", 0))
-        content = response.read(content_length)
-        
-        if response_headers.get("content-encoding") == "gzip":
-            content = gzip.decompress(content)
-        
-        cache.set(url, content, max_age=3600)
+        cache.set(self.cache_key, content, max_age=3600)
         return content
     
 
+class SocketReader:
+    def __init__(self, sock, buffer_size=READ_BUFFER_SIZE):
+        self.sock = sock
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+    
+    def fill(self) -> int:
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            # Out of room: slide the unread bytes to the front, or grow if full
+            pending = self.end - self.start
+            if self.start == 0:
+                self.view.release()
+                self.buffer = self.buffer + bytearray(len(self.buffer))
+                self.view = memoryview(self.buffer)
+            else:
+                self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, pending
+        n = self.sock.recv_into(self.view[self.end:])
+        self.end += n
+        return n
+    
+    def take(self, n: int) -> bytes:
+        data = bytes(self.view[self.start:self.start + n])
+        self.start += n
+        return data
+    
+    def read_until(self, delimiter: bytes) -> bytes:
+        scanned = 0
+        while True:
+            index = self.buffer.find(delimiter, self.start + scanned, self.end)
+            if index != -1:
+                return self.take(index + len(delimiter) - self.start)
+            # fill() may move the pending bytes, so track progress as an offset
+            scanned = max(0, self.end - self.start - len(delimiter) + 1)
+            if not self.fill():
+                return self.take(self.end - self.start)
+    
+    def readline(self) -> bytes:
+        return self.read_until(b"\r\n")
+    
+    def iter_read(self, size=-1):
+        # Yields views into the shared buffer; each is only valid until the next
+        remaining = size
+        while remaining:
+            if self.start == self.end and not self.fill():
+                break
+            n = self.end - self.start
+            if remaining > 0:
+                n = min(n, remaining)
+                remaining -= n
+            yield self.view[self.start:self.start + n]
+            self.start += n
+
+
+def _iter_chunked(response):
+    while True:
+        size_line = response.readline()
+        assert size_line, "Connection closed inside chunked body"
+        size = int(size_line.split(b";", 1)[0], 16)
+        if size == 0: break
+        yield from response.iter_read(size)
+        response.readline()
+    # Skip trailer headers up to the final blank line
+    while response.readline() not in (b"\r\n", b""):
+        pass
+
+
+def _read_body(chunks, gzipped: bool) -> bytes:
+    # Chunks may be views into the reader's buffer, so each is consumed immediately
+    if not gzipped:
+        return b"".join([bytes(chunk) for chunk in chunks])
+    decompressor = zlib.decompressobj(wbits=31)
+    parts = [decompressor.decompress(chunk) for chunk in chunks]
+    parts.append(decompressor.flush())
+    return b"".join(parts)
+
+
+@lru_cache(maxsize=None)
+def _ssl_context() -> ssl.SSLContext:
+    # Loading the system trust store is expensive, so it is done once, on first use
+    return ssl.create_default_context()
+
+
+def _resolve(host: str, port: int) -> tuple:
+    key = (host, port)
+    now = time.monotonic()
+    cached = _dns_cache.get(key)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    address = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)[0][4]
+    _dns_cache[key] = (address, now + DNS_TTL)
+    return address
+
+
+def _release_connection(pool_key: tuple, sock) -> None:
+    with _conn_pool_lock:
+        previous = _conn_pool.get(pool_key)
+        _conn_pool[pool_key] = sock
+    if previous is not None and previous is not sock:
+        previous.close()
+
+
 class FileURL(URL):
+    __slots__ = ("path",)
+    
     def __init__(self, scheme: str, url: str) -> None:
         super().__init__(scheme, url)
         self.path = self.url
         
     def request(self, max_redirects=5):
-        with open(self.path, "r", encoding="utf8") as f:
+        # Returned undecoded so lex() only has to decode the text left after stripping tags
+        with open(self.path, "rb") as f:
             return f.read()
         
 
 class DataURL(URL):
+    __slots__ = ("metadata", "data")
+    
     def __init__(self, scheme: str, url: str) -> None:
         super().__init__(scheme, url)
         assert "," in self.url, "Missing comma in data URL - data URLs should be in the form data:mimetype/base64,data"
@@ -157,6 +388,8 @@ class DataURL(URL):
 
  
 class ViewSourceURL(URL):
+    __slots__ = ("inner_url",)
+    
     def __init__(self, scheme: str, url: str) -> None:
         super().__init__(scheme, url)
         self.inner_url = URLFactory.create(self.url)
@@ -166,6 +399,8 @@ class ViewSourceURL(URL):
 
 
 class AboutBlankURL(URL):
+    __slots__ = ()
+    
     def __init__(self, scheme: str, url: str) -> None:
         super().__init__(scheme, url)
         
@@ -173,56 +408,102 @@ class AboutBlankURL(URL):
         return ""
 
 
+Authority = namedtuple("Authority", "host port path")
+
+
+def _split_scheme(url: str) -> tuple[str, str]:
+    colon = url.find(":")
+    assert colon > 0 and url[0].isalpha(), f"Invalid URL format: {url}"
+    # Up to three slashes separate the scheme from the rest (file:///path)
+    start = colon + 1
+    stop = min(start + 3, len(url))
+    while start < stop and url[start] == "/":
+        start += 1
+    return url[:colon], url[start:]
+
+
+def _parse_authority(url: str, default_port: int) -> Authority:
+    slash = url.find("/")
+    if slash == -1:
+        authority, path = url, "/"
+    else:
+        authority, path = url[:slash], url[slash:]
+    colon = authority.find(":")
+    if colon == -1:
+        return Authority(authority, default_port, path)
+    return Authority(authority[:colon], int(authority[colon + 1:]), path)
+
+
 class URLFactory:
     @staticmethod
     def create(url: str) -> URL:
-        match = URL_REGEX.match(url)
-        assert match, f"Invalid URL format: {url}"
-        scheme = match.group("scheme")
-        url = match.group("url")
-        assert scheme in SCHEMES, f"Unknown scheme: {scheme}"
+        scheme, rest = _split_scheme(url)
+        scheme = sys.intern(scheme)
+        url_class = _SCHEME_MAP.get(scheme)
+        assert url_class, f"Unknown scheme: {scheme}"
         
-        print(f"Creating URL object for scheme={scheme} url={url}")
-        if scheme == "http" or scheme == "https": # http://www.google.com
-            return HTTPURL(scheme, url)
-        if scheme == "file": # file:///path/to/file.html
-            return FileURL(scheme, url)
-        if scheme == "data": # data:text/plain;base64,SGVsbG8sIFdvcmxkIQ%3D%3D
-            return DataURL(scheme, url)
-        if scheme == "view-source": # view-source:http://www.google.com
-            return ViewSourceURL(scheme, url)
-        if scheme == "about": # about:blank
-            return AboutBlankURL(scheme, url)
+        print(f"Creating URL object for scheme={scheme} url={rest}")
+        return url_class(scheme, rest)
+
+
+_SCHEME_MAP = {
+    "http": HTTPURL,         # http://www.google.com
+    "https": HTTPURL,        # https://www.google.com
+    "file": FileURL,         # file:///path/to/file.html
+    "data": DataURL,         # data:text/plain;base64,SGVsbG8sIFdvcmxkIQ%3D%3D
+    "view-source": ViewSourceURL,  # view-source:http://www.google.com
+    "about": AboutBlankURL,  # about:blank
+}
+
+SCHEMES = tuple(_SCHEME_MAP)
+
+
+def fetch_all(urls: list[str], max_workers: int = 8) -> list:
+    # Network latency dominates, so overlapping the requests in threads makes
+    # the total time close to the slowest fetch instead of the sum of all.
+    url_objects = [URLFactory.create(url) for url in urls]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda url: url.request(), url_objects))
     
     
 def lex(body, raw=False) -> str:
-    text = ""
-    if raw:
-        return body
-    
-    body = body.replace("&lt;", "<").replace("&gt;", ">")
-    in_tag = False
-    for c in body:
-        if c == "<":
-            in_tag = True
-        elif c == ">":
-            in_tag = False
-        elif not in_tag:
-            text += c
-    return text
+    # HTTP bodies arrive as bytes; tags are stripped before decoding so only the
+    # visible text is ever turned into a str ('<' and '>' never occur inside a
+    # multi-byte UTF-8 sequence, so this is safe)
+    if isinstance(body, bytes):
+        tag_regex, lt, gt, amp = BYTES_TAG_REGEX, b"<", b">", b"&"
+    else:
+        tag_regex, lt, gt, amp = TAG_REGEX, "<", ">", "&"
+    
+    text = body
+    if not raw:
+        # The memchr-backed membership test lets markup-free bodies skip the regex
+        if lt in text:
+            text = tag_regex.sub(text[:0], text)
+            # Whatever '<' survives opens an unterminated tag
+            unterminated = text.find(lt)
+            if unterminated != -1:
+                text = text[:unterminated]
+        if gt in text:
+            text = text.replace(gt, text[:0])
+    # Checked before decoding so bodies without entities never reach unescape
+    escaped = not raw and amp in text
+    
+    if isinstance(text, bytes):
+        text = text.decode("utf8", errors="replace")
+    if not escaped:
+        return text
+    # Decode entities after stripping so an escaped &lt;tag&gt; stays visible text
+    return unescape(text)
 
 def _load(url: URL) -> None:
     body = url.request()
-    if isinstance(body, bytes):
-        body = body.decode("utf8", errors="replace")
-    if url.scheme == "view-source":
-        print(lex(body, raw=True))
-    else:
-        print(lex(body))
+    text = lex(body, raw=url.scheme == "view-source")
+    sys.stdout.write(text)
+    sys.stdout.write("\n")
+    sys.stdout.flush()
   
 if __name__ == "__main__":
-    import sys
-    
     ASSETS_DIR = os.path.join(os.path.dirname(__file__), "..", "assets")
     TEST_DEFAULT = os.path.join(ASSETS_DIR, "example.html")
     TEST_ENTITIES = os.path.join(ASSETS_DIR, "entities.html")
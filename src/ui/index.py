@@ -1,26 +1,46 @@
 from __future__ import annotations
 
 import os
+import base64
+import zipfile
 import tkinter as tk
+import tkinter.font as tkfont
 import platform
-import argparse
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from functools import lru_cache
 from logging import warning
 from pathlib import Path
+from types import SimpleNamespace
 from ..core.url import URL, lex, URLFactory
 
 width, height = 800, 600
 HSTEP, VSTEP = 13, 18
+FONT_FAMILY, FONT_SIZE = "Courier", 12
 SCROLL_STEP = 100
+RESIZE_DELAY_MS = 50
 OS = platform.system()
 ASSETS_DIR = Path(__file__).parent.parent / "assets"
+EMOJI_DIR = ASSETS_DIR / "emojis"
+EMOJI_ARCHIVE = ASSETS_DIR / "emojis.zip"
 test_file = ASSETS_DIR / "default.html"
 test_file2 = ASSETS_DIR / "entities.html"
 
+# Parallel arrays: entry i is the text run runs[i] drawn at (xs[i], ys[i])
+DisplayList = namedtuple("DisplayList", "xs ys runs")
+
 class Browser:
-    def __init__(self, direction="ltr"):
-        self.display_list = []
+    def __init__(self, direction="ltr", emoji_support=True, scrollbar=True):
         self.scroll = 0
         self.direction = direction
+        self.text = ""
+        # Only a new page or a new window size invalidates the layout, never a scroll
+        self.layout_dirty = False
+        self.resize_job = None
+        self.drawn = {}
+        self.drawn_scroll = 0
         self.window = tk.Tk()
         self.canvas = tk.Canvas(
             self.window,
@@ -28,39 +48,127 @@ class Browser:
             height=height,
         )
         self.canvas.pack(fill=tk.BOTH, expand=tk.YES)
-        self.emoji_images = self.load_emoji_images()
+        # Runs of text are drawn as one item, so the layout grid is taken from the
+        # metrics of a monospace font instead of assuming HSTEP x VSTEP glyphs
+        self.font = tkfont.Font(family=FONT_FAMILY, size=FONT_SIZE)
+        self.hstep = self.font.measure("M")
+        self.vstep = self.font.metrics("linespace")
+        self.display_list = layout(self.text, width, height, direction, frozenset(), self.hstep, self.vstep)
+        self.bottoms = array("i")
+        # Optional features are resolved here once, so the draw paths never
+        # check them per call
+        if scrollbar:
+            # The scrollbar items are created once and only moved or hidden afterwards
+            self.scrollbar_track = self.canvas.create_rectangle(
+                0, 0, 0, 0, fill="lightgrey", state="hidden", tags="scrollbar"
+            )
+            self.scrollbar_thumb = self.canvas.create_rectangle(
+                0, 0, 0, 0, fill="blue", state="hidden", tags="scrollbar"
+            )
+            self.scrollbar_visible = False
+        else:
+            self.draw_scrollbar = self.skip_scrollbar
+        self.emoji_source = EMOJI_ARCHIVE if EMOJI_ARCHIVE.is_file() else EMOJI_DIR
+        # Without emoji support every glyph stays part of a text run
+        self.emojis = emoji_chars(self.emoji_source) if emoji_support else frozenset()
         self.setup_binds()
     
     def draw(self):
-        self.canvas.delete("all")
-        for x, y, c in self.display_list:
-            if y > self.scroll + height: continue
-            if y + VSTEP < self.scroll: continue
-            if c in self.emoji_images:
-                self.canvas.create_image(x, y - self.scroll, image=self.emoji_images[c], anchor="nw")
-            else:
-                self.canvas.create_text(x, y - self.scroll, text=c)
+        # Full rebuild, needed whenever the display list or the window size changes
+        if self.layout_dirty:
+            self.display_list = layout(
+                self.text, width, height, self.direction, self.emojis, self.hstep, self.vstep
+            )
+            if self.direction == "ttb":
+                # Columns restart at the top, so ys is not sorted and cannot be
+                # bisected; keep the y of each entry's last glyph for culling instead
+                _, ys, runs = self.display_list
+                self.bottoms = array("i", (y + run.count("\n") * self.vstep for y, run in zip(ys, runs)))
+            self.scroll = min(self.scroll, max(0, self.doc_height() - height))
+            self.layout_dirty = False
+        self.canvas.delete("content")
+        self.drawn = {}
+        self.drawn_scroll = self.scroll
+        self.draw_content()
+        self.draw_scrollbar()
+    
+    def draw_scrolled(self):
+        # Existing items are shifted in place; only rows entering or leaving the
+        # viewport are created or deleted. Scrolling never re-runs layout().
+        assert not self.layout_dirty, "scrolled before the new layout was drawn"
+        self.canvas.move("content", 0, self.drawn_scroll - self.scroll)
+        self.drawn_scroll = self.scroll
+        self.draw_content()
         self.draw_scrollbar()
+    
+    def draw_content(self):
+        xs, ys, runs = self.display_list
+        visible = self.visible_entries()
+        drawn = self.drawn
+        delete = self.canvas.delete
+        for i in [i for i in drawn if i not in visible]:
+            delete(drawn.pop(i))
+        # Hoisted out of the loop so each item only costs local lookups
+        scroll, emojis, emoji_source = self.scroll, self.emojis, self.emoji_source
+        create_image = self.canvas.create_image
+        # Text items go straight to the Tcl command, skipping the kwargs
+        # flattening Canvas.create_text repeats for every run
+        call, path, font = self.canvas.tk.call, str(self.canvas), str(self.font)
+        for i in visible:
+            if i in drawn: continue
+            x, y, run = xs[i], ys[i], runs[i]
+            if run in emojis:
+                drawn[i] = create_image(x, y - scroll, image=emoji_image(emoji_source, run), anchor="nw", tags="content")
+            else:
+                drawn[i] = call(path, "create", "text", x, y - scroll, "-text", run, "-anchor", "nw", "-font", font, "-tags", "content")
+    
+    def visible_entries(self):
+        ys = self.display_list.ys
+        top, bottom = self.scroll - self.vstep, self.scroll + height
+        if self.direction == "ttb":
+            # Blank lines push paragraphs below the window, so entries are still
+            # culled, just by scanning their spans rather than bisecting
+            return {i for i, (y, end) in enumerate(zip(ys, self.bottoms)) if y <= bottom and end >= top}
+        return range(bisect_left(ys, top), bisect_right(ys, bottom))
+    
+    def doc_height(self):
+        ys = self.display_list.ys
+        if not ys:
+            return 0
+        if self.direction == "ttb":
+            return max(self.bottoms) + self.vstep
+        return ys[-1] + self.vstep
         
     def draw_scrollbar(self):
-        doc_height = len(self.display_list)
-        if doc_height <= height: return
+        doc_height = self.doc_height()
+        visible = doc_height > height
+        if visible != self.scrollbar_visible:
+            state = "normal" if visible else "hidden"
+            self.canvas.itemconfigure(self.scrollbar_track, state=state)
+            self.canvas.itemconfigure(self.scrollbar_thumb, state=state)
+            self.scrollbar_visible = visible
+        if not visible: return
         
         bar_height = max(100, height * height / doc_height)
         max_scroll = doc_height - height
         scroll_ratio = self.scroll / max_scroll
         bar_y = scroll_ratio * (height - bar_height)
         
-        self.canvas.create_rectangle(
+        self.canvas.coords(
+            self.scrollbar_track,
             width - 20, 0,
             width - 10, height,
-            fill="lightgrey"
-        ) 
-        self.canvas.create_rectangle(
+        )
+        self.canvas.coords(
+            self.scrollbar_thumb,
             width - 20, bar_y,
             width - 10, bar_y + bar_height,
-            fill="blue"
         )
+        # Content created after the scrollbar would otherwise be stacked above it
+        self.canvas.tag_raise("scrollbar")
+    
+    def skip_scrollbar(self):
+        pass
       
     def load(self, url: str):
         try:
@@ -71,26 +179,11 @@ class Browser:
             url = URLFactory.create("about://blank")
             body = url.request()
 
-        if isinstance(body, bytes):
-            body = body.decode("utf8", errors="replace")
-            
-        if url.scheme == "view-source":
-            text = lex(body, raw=True)
-        else:
-            text = lex(body)
-        self.display_list = layout(text, self.direction)
+        # view-source text is shown as-is, so lex only has to decode it
+        self.text = lex(body, raw=url.scheme == "view-source")
+        self.layout_dirty = True
         self.draw()
     
-    def load_emoji_images(self):
-        emoji_dir = ASSETS_DIR / "emojis"
-        files = [f for f in os.listdir(emoji_dir) if f.endswith("_color.png")]
-        images = {}
-        for emoji_file in files:
-            emoji_code = os.path.splitext(emoji_file)[0].split('_')[0]
-            path = os.path.join(emoji_dir, emoji_file)
-            images[emoji_code] = tk.PhotoImage(file=path)
-        return images
-    
     # === BINDS SETUP ===    
     def windows_bindings(self):
         self.window.bind("<MouseWheel>", self.wheelscroll)
@@ -124,6 +217,14 @@ class Browser:
     def on_resize(self, event):
         global width, height
         width, height = event.width, event.height
+        # Dragging a window edge fires a burst of events; only lay out once it settles
+        if self.resize_job is not None:
+            self.window.after_cancel(self.resize_job)
+        self.resize_job = self.window.after(RESIZE_DELAY_MS, self.resize_redraw)
+    
+    def resize_redraw(self):
+        self.resize_job = None
+        self.layout_dirty = True
         self.draw()
     
     def wheelscroll(self, event):
@@ -134,45 +235,198 @@ class Browser:
         
     def scrolldown(self, event):
         self.scroll += SCROLL_STEP
-        if self.scroll > len(self.display_list) * VSTEP - height:
-            self.scroll = len(self.display_list) * VSTEP - height
-        self.draw()
+        max_scroll = max(0, self.doc_height() - height)
+        if self.scroll > max_scroll:
+            self.scroll = max_scroll
+        self.draw_scrolled()
         
     def scrollup(self, event):
         self.scroll -= SCROLL_STEP
         if self.scroll < 0:
             self.scroll = 0
-        self.draw()
+        self.draw_scrolled()
+
+@lru_cache(maxsize=None)
+def emoji_archive(emoji_source):
+    # A single zip of all the PNGs is opened once for the whole session,
+    # sparing one open/close per emoji; a plain directory is used otherwise
+    if zipfile.is_zipfile(emoji_source):
+        return zipfile.ZipFile(emoji_source)
+    return None
+
+@lru_cache(maxsize=None)
+def emoji_files(emoji_source):
+    # Maps each emoji glyph to its PNG (an archive member or a file path). Only the
+    # names are read up front; images are decoded on first draw.
+    archive = emoji_archive(emoji_source)
+    if archive is not None:
+        names = archive.namelist()
+    elif os.path.isdir(emoji_source):
+        names = [os.path.join(emoji_source, name) for name in os.listdir(emoji_source)]
+    else:
+        warning(f"Emoji assets not found: {emoji_source}")
+        return {}
+    files = {}
+    for name in names:
+        emoji_file = os.path.basename(name)
+        if not emoji_file.endswith("_color.png"): continue
+        emoji_code = os.path.splitext(emoji_file)[0].split('_')[0]
+        # Multi-codepoint sequences (e.g. 1F468-200D-1F469) cannot match a single glyph
+        if "-" in emoji_code: continue
+        files[chr(int(emoji_code, 16))] = name
+    return files
+
+def emoji_chars(emoji_source):
+    return frozenset(emoji_files(emoji_source))
+
+# Unbounded on purpose: the cache holds the only reference to each PhotoImage
+# and an evicted one is deleted from Tk, blanking every item still showing it.
+# Only glyphs that are actually drawn are loaded, so it never outgrows the set.
+@lru_cache(maxsize=None)
+def emoji_image(emoji_source, c):
+    name = emoji_files(emoji_source)[c]
+    archive = emoji_archive(emoji_source)
+    if archive is not None:
+        data = archive.read(name)
+    else:
+        with open(name, "rb") as f:
+            data = f.read()
+    # Tk only accepts in-memory image data base64 encoded
+    return tk.PhotoImage(data=base64.b64encode(data).decode("ascii"))
+
+def layout(text, width, height, direction="ltr", emojis=frozenset(), hstep=HSTEP, vstep=VSTEP):
+    # Consecutive glyphs on one line are merged into a single run so draw() can
+    # emit one canvas item per line instead of one per character.
+    # Emojis always get an entry of their own since they are drawn as images.
+    # Results are cached and shared between callers, so they must not be mutated.
+    if direction == "ttb":
+        return _layout_columns(text, height, emojis, hstep, vstep)
+    return _layout_rows(text, width, direction == "rtl", emojis, hstep, vstep)
+
+# Each direction only depends on one window dimension, so they are cached
+# separately and e.g. a purely vertical resize keeps the row layout
+@lru_cache(maxsize=8)
+def _layout_rows(text, width, rtl, emojis, hstep, vstep):
+    # Every glyph advances by hstep, so a paragraph wraps into rows of exactly
+    # chars_per_line characters and its positions follow from arithmetic alone
+    xs, ys, runs = array("i"), array("i"), []
+    chars_per_line = max(1, (width - hstep) // hstep)
+    cursor_y = vstep
+    for paragraph in _paragraphs(text):
+        for start in range(0, len(paragraph), chars_per_line):
+            row = paragraph[start:start + chars_per_line]
+            if not emojis or row.isascii():
+                segments = ((0, len(row)),)
+            else:
+                segments = _split_emojis(row, emojis)
+            for a, b in segments:
+                if rtl:
+                    # Drawn left to right from the last glyph, which sits furthest left
+                    xs.append(width - hstep - (b - 1) * hstep)
+                    runs.append(row[a:b][::-1])
+                else:
+                    xs.append(hstep + a * hstep)
+                    runs.append(row[a:b])
+                ys.append(cursor_y)
+            cursor_y += vstep
+        # The row that held the last glyph is only counted if it filled up and wrapped
+        if len(paragraph) % chars_per_line:
+            cursor_y -= vstep
+        cursor_y += vstep * 2  # Paragraph break
+    return DisplayList(xs, ys, runs)
+
+def _paragraphs(text):
+    # str.find locates each break with a C-level scan and only one paragraph is
+    # sliced out at a time, instead of split() building the whole list up front
+    start = 0
+    while True:
+        end = text.find("\n", start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+def _split_emojis(row, emojis):
+    segments = []
+    start = 0
+    for i, c in enumerate(row):
+        if c in emojis:
+            if start < i:
+                segments.append((start, i))
+            segments.append((i, i + 1))
+            start = i + 1
+    if start < len(row):
+        segments.append((start, len(row)))
+    return segments
+
+@lru_cache(maxsize=8)
+def _layout_columns(text, height, emojis, hstep, vstep):
+    # Top-to-bottom counterpart of _layout_rows. Glyphs stacked in one column are
+    # emitted as a single newline-joined run, which lines up because vstep is the
+    # font's linespace. A paragraph continues from where the previous one stopped,
+    # so only its first column is shorter; every later one starts back at the top.
+    xs, ys, runs = array("i"), array("i"), []
+    bottom = height - vstep
+    rows_per_column = max(1, (bottom - vstep) // vstep + 1)
+    cursor_y = vstep
+    for paragraph in _paragraphs(text):
+        length = len(paragraph)
+        if not length:
+            # A blank line only moves the cursor; it has no column to emit
+            cursor_y += vstep * 2
+            continue
+        first = max(1, (bottom - cursor_y) // vstep + 1)
+        columns = [(0, min(length, first), hstep, cursor_y)]
+        for i, start in enumerate(range(first, length, rows_per_column)):
+            columns.append((start, min(length, start + rows_per_column), hstep * (i + 2), vstep))
+        for a, b, x, y in columns:
+            column = paragraph[a:b]
+            if not emojis or column.isascii():
+                segments = ((0, len(column)),)
+            else:
+                segments = _split_emojis(column, emojis)
+            for i, j in segments:
+                xs.append(x)
+                ys.append(y + i * vstep)
+                runs.append("\n".join(column[i:j]))
+        # Where the last glyph left the cursor, before the paragraph break
+        if length < first:
+            cursor_y += length * vstep
+        elif (length - first) % rows_per_column:
+            cursor_y = vstep + (length - first) % rows_per_column * vstep
+        else:
+            cursor_y = vstep
+        cursor_y += vstep * 2  # Paragraph break
+    return DisplayList(xs, ys, runs)
+
+DIRECTIONS = ("ltr", "rtl", "ttb")
+
+def parse_args(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # The common launch is just "URL [-d DIR]": parse that by hand and only
+    # build the argparse parser for help, version or malformed arguments
+    url, direction = None, "ltr"
+    args = iter(argv)
+    for arg in args:
+        if arg in ("-d", "--direction"):
+            direction = next(args, None)
+        elif arg.startswith("--direction="):
+            direction = arg[len("--direction="):]
+        elif arg.startswith("-d") and len(arg) > 2:
+            direction = arg[2:]
+        elif arg.startswith("-") or url is not None:
+            break
+        else:
+            url = arg
+        if direction not in DIRECTIONS:
+            break
+    else:
+        return SimpleNamespace(url=url, direction=direction)
+    return _parse_args_full(argv)
 
-def layout(text, direction="ltr"):
-    display_list = []
-    cursor_x, cursor_y = HSTEP, VSTEP
-    if direction == "rtl":
-        cursor_x = width - HSTEP
-    for c in text:
-        if c == "\n":  # Paragraph break
-            cursor_y += VSTEP * 2
-            cursor_x = HSTEP if direction != "rtl" else width - HSTEP
-        else:  # Normal character
-            display_list.append((cursor_x, cursor_y, c))
-            if direction == "ltr":
-                cursor_x += HSTEP
-                if cursor_x > width - HSTEP:
-                    cursor_y += VSTEP
-                    cursor_x = HSTEP
-            elif direction == "rtl":
-                cursor_x -= HSTEP
-                if cursor_x < HSTEP:
-                    cursor_y += VSTEP
-                    cursor_x = width - HSTEP
-            elif direction == "ttb":
-                cursor_y += VSTEP
-                if cursor_y > height - VSTEP:
-                    cursor_x += HSTEP
-                    cursor_y = VSTEP
-    return display_list
-
-def parse_args():
+def _parse_args_full(argv):
+    import argparse
     parser = argparse.ArgumentParser(
         prog="pybrow",
         description="A simple web browser inspired on the book Web Browser Engineering.",
@@ -187,7 +441,7 @@ def parse_args():
     )
     parser.add_argument(
         "--direction", "-d",
-        choices=["ltr", "rtl", "ttb"],
+        choices=DIRECTIONS,
         default="ltr",
         help="Text direction: ltr (left-to-right), rtl (right-to-left), ttb (top-to-bottom)"
     )
@@ -196,7 +450,7 @@ def parse_args():
         action="version",
         version="%(prog)s 1.0"
     )
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
     args = parse_args()
@@ -0,0 +1,84 @@
+import socket
+import threading
+import time
+import unittest
+
+from src.core import url as url_module
+from src.core.url import URLFactory
+
+
+class BodylessResponseTest(unittest.TestCase):
+    # The server answers every request on one keep-alive connection and never
+    # closes it, so a client that waits for EOF would time out
+
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.accepted = 0
+        self.done = threading.Event()
+        self.thread = None
+        # Fail instead of hanging if the client blocks on the body
+        self.previous_timeout = socket.getdefaulttimeout()
+        socket.setdefaulttimeout(2)
+
+    def tearDown(self):
+        socket.setdefaulttimeout(self.previous_timeout)
+        self.done.set()
+        sock = url_module._conn_pool.pop(("http", "127.0.0.1", self.port), None)
+        if sock:
+            sock.close()
+        self.listener.close()
+        if self.thread:
+            self.thread.join(timeout=2)
+
+    def start(self, responses):
+        # Each response is a list of parts, sent as separate segments
+        self.thread = threading.Thread(target=self.serve, args=(responses,), daemon=True)
+        self.thread.start()
+
+    def serve(self, responses):
+        conn, _ = self.listener.accept()
+        self.accepted += 1
+        with conn:
+            for parts in responses:
+                request = b""
+                while b"\r\n\r\n" not in request:
+                    data = conn.recv(4096)
+                    if not data:
+                        return
+                    request += data
+                for i, part in enumerate(parts):
+                    if i:
+                        time.sleep(0.05)
+                    conn.sendall(part)
+            self.done.wait(timeout=5)
+
+    def fetch(self, path):
+        return URLFactory.create(f"http://127.0.0.1:{self.port}{path}").request()
+
+    def test_no_content_keeps_connection(self):
+        self.start([
+            [b"HTTP/1.1 204 No Content\r\n\r\n"],
+            [b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello"],
+        ])
+        self.assertEqual(self.fetch("/no-content"), b"")
+        # The next response arrives on the same pooled connection
+        self.assertEqual(self.fetch("/ok"), b"hello")
+        self.assertEqual(self.accepted, 1)
+
+    def test_interim_response_is_skipped(self):
+        self.start([
+            [b"HTTP/1.1 103 Early Hints\r\nLink: </style.css>\r\n\r\n",
+             b"HTTP/1.1 200 OK\r\nContent-Length: 6\r\n\r\npage-a"],
+            [b"HTTP/1.1 200 OK\r\nContent-Length: 6\r\n\r\npage-b"],
+        ])
+        self.assertEqual(self.fetch("/a"), b"page-a")
+        # Nothing from the first exchange is left on the pooled connection
+        self.assertEqual(self.fetch("/b"), b"page-b")
+        self.assertEqual(self.accepted, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()